@@ -2,12 +2,21 @@ import argparse
 import yaml
 import os
 import logging
-from pymongo import MongoClient
+import functools
+from pymongo import MongoClient, ASCENDING
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import sys
 from datetime import datetime
 
+# Key pattern of the matches index every batch query is hinted to
+COMPETITION_ID_INDEX = [('competition_id', ASCENDING)]
+
+# Match fields that must be present and numeric for a match to be used
+REQUIRED_NUMERIC_FIELDS = ('homeGoalCount', 'awayGoalCount', 'home_elo_pre_match_HA', 'away_elo_pre_match_HA')
+
 def parse_arguments():
     """
     Parse command-line arguments for configuration.
@@ -44,9 +53,12 @@ def setup_logging(log_file_path):
 def retrieve_matches(matches_collection, competition_ids):
     """
     Retrieve all matches for the specified competition IDs from the MongoDB collection.
+    Matches missing a goal count or pre-match ELO, or holding a non-numeric value, are filtered out server-side.
     """
     try:
-        matches_cursor = matches_collection.find({"competition_id": {"$in": competition_ids}})
+        query = {"competition_id": {"$in": competition_ids}}
+        query.update({field: {"$type": "number"} for field in REQUIRED_NUMERIC_FIELDS})
+        matches_cursor = matches_collection.find(query).hint(COMPETITION_ID_INDEX)
         matches = list(matches_cursor)
         logging.info(f"Retrieved {len(matches)} matches for the specified competition IDs from the database.")
         return matches
@@ -60,42 +72,44 @@ def compute_elo_gap(home_elo, away_elo):
     """
     return home_elo - away_elo
 
-def bin_elo_gaps(elo_gaps, bin_size=50, max_gap=500):
+@functools.lru_cache(maxsize=None)
+def _make_bins(bin_size, max_gap):
     """
-    Bin ELO gaps into intervals.
+    Build the ELO gap bin edges and their labels once per (bin_size, max_gap).
     """
     bins = np.arange(-max_gap - bin_size, max_gap + bin_size + 1, bin_size)
-    labels = [f"{int(bins[i])}-{int(bins[i+1]-1)}" for i in range(len(bins)-1)]
-    binned = pd.cut(elo_gaps, bins=bins, labels=labels, include_lowest=True)
-    return binned
+    labels = tuple(f"{int(bins[i])}-{int(bins[i+1]-1)}" for i in range(len(bins)-1))
+    return bins, labels
 
-def calculate_average_goal_diff(df, goal_diff_column='goal_diff'):
+def elo_gap_bin_codes(elo_gaps, bin_size=50, max_gap=500):
     """
-    Calculate the average goal difference for each ELO gap bin.
+    Map ELO gaps to their bin positions, with -1 for NaN/infinite gaps and gaps outside the outermost bins.
     """
-    avg_goal_diff = df.groupby('elo_gap_bin')[goal_diff_column].mean().reset_index()
-    avg_goal_diff.rename(columns={goal_diff_column: 'avg_goal_diff'}, inplace=True)
-    return avg_goal_diff
+    _, labels = _make_bins(bin_size, max_gap)
+    positions = np.floor_divide(np.asarray(elo_gaps, dtype=np.float64) + max_gap + bin_size, bin_size)
+    out_of_range = ~np.isfinite(positions) | (positions < 0) | (positions >= len(labels))
+    codes = np.where(out_of_range, -1, positions).astype(np.int16)
+    return codes
 
-def extract_lower_bound(bin_str):
+def accumulate_batch(matches, bin_size, max_gap):
     """
-    Safely extract the lower bound from an elo_gap_bin string.
+    Reduce a batch of matches to per-bin goal difference sums and match counts.
     """
-    try:
-        # Remove any whitespace
-        bin_str = bin_str.strip()
-        # Use regex to match the lower bound
-        import re
-        match = re.match(r'^(-?\d+)-', bin_str)
-        if match:
-            lower_bound_str = match.group(1)
-            return int(lower_bound_str)
-        else:
-            logging.error(f"Could not parse elo_gap_bin '{bin_str}'")
-            return None
-    except Exception as e:
-        logging.error(f"Failed to extract lower bound from elo_gap_bin '{bin_str}': {e}")
-        return None
+    _, labels = _make_bins(bin_size, max_gap)
+    nbins = len(labels)
+    n_matches = len(matches)
+    home_goals = np.fromiter((m['homeGoalCount'] for m in matches), dtype=np.float64, count=n_matches)
+    away_goals = np.fromiter((m['awayGoalCount'] for m in matches), dtype=np.float64, count=n_matches)
+    home_elos = np.fromiter((m['home_elo_pre_match_HA'] for m in matches), dtype=np.float64, count=n_matches)
+    away_elos = np.fromiter((m['away_elo_pre_match_HA'] for m in matches), dtype=np.float64, count=n_matches)
+
+    goal_diffs = home_goals - away_goals
+    codes = elo_gap_bin_codes(compute_elo_gap(home_elos, away_elos), bin_size=bin_size, max_gap=max_gap)
+    in_range = codes >= 0
+
+    batch_sums = np.bincount(codes[in_range], weights=goal_diffs[in_range], minlength=nbins)
+    batch_counts = np.bincount(codes[in_range], minlength=nbins)
+    return batch_sums, batch_counts
 
 def split_into_batches(lst, batch_size):
     """
@@ -111,91 +125,39 @@ def process_competitions(matches_collection, competition_ids, output_file, bin_s
     logging.info(f"Processing competitions with IDs: {competition_ids}")
     
     # Initialize bins
-    bins = np.arange(-max_gap - bin_size, max_gap + bin_size + 1, bin_size)
-    bin_labels = [f"{int(bins[i])}-{int(bins[i+1]-1)}" for i in range(len(bins)-1)]
-    all_bins = pd.Categorical(bin_labels, categories=bin_labels, ordered=True)
+    bins, bin_labels = _make_bins(bin_size, max_gap)
+    lower_bounds = bins[:-1].astype(int)
     
-    # Initialize sums and counts dictionaries
-    sums = {bin_label: 0.0 for bin_label in bin_labels}
-    counts = {bin_label: 0 for bin_label in bin_labels}
+    # Initialize sums and counts arrays, indexed by bin position
+    nbins = len(bin_labels)
+    sums = np.zeros(nbins, dtype=np.float64)
+    counts = np.zeros(nbins, dtype=np.int64)
     
     # Split competition IDs into batches
-    batches = list(split_into_batches(competition_ids, batch_size))
-    logging.info(f"Competition IDs divided into {len(batches)} batches of size up to {batch_size}.")
+    n_batches = -(-len(competition_ids) // batch_size)
+    logging.info(f"Competition IDs divided into {n_batches} batches of size up to {batch_size}.")
     
-    for batch_num, batch_competition_ids in enumerate(batches, start=1):
-        logging.info(f"Processing batch {batch_num}/{len(batches)} with competition IDs: {batch_competition_ids}")
+    for batch_num, batch_competition_ids in enumerate(split_into_batches(competition_ids, batch_size), start=1):
+        logging.info(f"Processing batch {batch_num}/{n_batches} with competition IDs: {batch_competition_ids}")
         # Retrieve Matches
         matches = retrieve_matches(matches_collection, batch_competition_ids)
         if not matches:
             logging.warning(f"No matches retrieved for batch {batch_num}. Skipping.")
             continue
         
-        # Prepare DataFrame
-        data = []
-        for match in matches:
-            match_id = match.get('id')
-            try:
-                home_elo = float(match['home_elo_pre_match_HA'])
-                away_elo = float(match['away_elo_pre_match_HA'])
-                home_goals = int(match['homeGoalCount'])
-                away_goals = int(match['awayGoalCount'])
-                goal_diff = home_goals - away_goals
-                elo_gap = compute_elo_gap(home_elo, away_elo)
-                
-                data.append({
-                    'match_id': match_id,
-                    'home_id': match.get('homeID'),
-                    'away_id': match.get('awayID'),
-                    'home_goals': home_goals,
-                    'away_goals': away_goals,
-                    'goal_diff': goal_diff,
-                    'elo_gap': elo_gap
-                })
-            except KeyError as e:
-                logging.warning(f"Match ID {match_id} is missing field {e}. Skipping.")
-                continue
-            except (ValueError, TypeError):
-                logging.warning(f"Invalid data types for Match ID {match_id}. Skipping.")
-                continue
-        
-        df = pd.DataFrame(data)
-        logging.info(f"Prepared DataFrame with {len(df)} valid matches for batch {batch_num}.")
-        
-        if df.empty:
-            logging.warning(f"DataFrame is empty for batch {batch_num}. Skipping.")
-            continue
-        
-        # Bin ELO Gaps
-        df['elo_gap_bin'] = bin_elo_gaps(df['elo_gap'], bin_size=bin_size, max_gap=max_gap)
-        logging.info(f"Binned ELO gaps into intervals for batch {batch_num}.")
-        
-        # Calculate sums and counts for each bin
-        bin_sums = df.groupby('elo_gap_bin')['goal_diff'].sum()
-        bin_counts = df.groupby('elo_gap_bin')['goal_diff'].count()
-        
-        # Update overall sums and counts
-        for bin_label in bin_labels:
-            sums[bin_label] += bin_sums.get(bin_label, 0.0)
-            counts[bin_label] += bin_counts.get(bin_label, 0)
+        # Reduce the batch to per-bin sums and counts
+        batch_sums, batch_counts = accumulate_batch(matches, bin_size, max_gap)
+        sums += batch_sums
+        counts += batch_counts
         
         logging.info(f"Updated sums and counts for batch {batch_num}.")
     
-    # After processing all batches, compute the average goal differences
-    avg_goal_diff_data = []
-    for bin_label in bin_labels:
-        total_sum = sums[bin_label]
-        total_count = counts[bin_label]
-        if total_count > 0:
-            avg_goal_diff = total_sum / total_count
-        else:
-            avg_goal_diff = 0.0
-        avg_goal_diff_data.append({
-            'elo_gap_bin': bin_label,
-            'avg_goal_diff': avg_goal_diff
-        })
-    
-    avg_goal_diff_df = pd.DataFrame(avg_goal_diff_data)
+    # After processing all batches, compute the average goal differences (0.0 for empty bins)
+    avg_goal_diffs = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+    avg_goal_diff_df = pd.DataFrame({
+        'elo_gap_bin': bin_labels,
+        'avg_goal_diff': avg_goal_diffs
+    })
     logging.info("Calculated average goal differences for each ELO gap bin.")
     
     # Add Computed At Timestamp
@@ -204,15 +166,19 @@ def process_competitions(matches_collection, competition_ids, output_file, bin_s
     # Reorder Columns
     avg_goal_diff_df = avg_goal_diff_df[['computed_at', 'elo_gap_bin', 'avg_goal_diff']]
     
-    # Sort the bins numerically
-    avg_goal_diff_df['elo_gap_lower'] = avg_goal_diff_df['elo_gap_bin'].apply(extract_lower_bound)
-    avg_goal_diff_df = avg_goal_diff_df.dropna(subset=['elo_gap_lower']).sort_values('elo_gap_lower').drop('elo_gap_lower', axis=1)
+    # Sort the bins numerically by their known lower bounds
+    avg_goal_diff_df['_lb'] = lower_bounds
+    avg_goal_diff_df = avg_goal_diff_df.sort_values('_lb').drop('_lb', axis=1)
     
     # Save Results
     try:
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        # CSV is kept for human inspection and for masseys-method.py, which reads it
         avg_goal_diff_df.to_csv(output_file, index=False)
-        logging.info(f"Overall average goal differences saved to {output_file}.")
+        parquet_file = os.path.splitext(output_file)[0] + '.parquet'
+        table = pa.Table.from_pandas(avg_goal_diff_df, preserve_index=False)
+        pq.write_table(table, parquet_file, compression='zstd')
+        logging.info(f"Overall average goal differences saved to {output_file} and {parquet_file}.")
     except Exception as e:
         logging.error(f"Failed to save results to {output_file}: {e}")
 
@@ -250,9 +216,16 @@ def main():
 
     # === Connect to MongoDB ===
     try:
-        client = MongoClient(MONGO_URI)
+        # Read-only batch workload: compress wire traffic. Reads stay on the primary, where create_index
+        # below guarantees the index that retrieve_matches hints to exists
+        client = MongoClient(
+            MONGO_URI,
+            compressors="zstd,snappy,zlib",
+            maxPoolSize=16
+        )
         db = client[DATABASE_NAME]
         matches_collection = db[MATCHES_COLLECTION_NAME]
+        matches_collection.create_index(COMPETITION_ID_INDEX)
         logging.info(f"Connected to MongoDB at {MONGO_URI}, database: {DATABASE_NAME}, collection: {MATCHES_COLLECTION_NAME}.")
     except Exception as e:
         logging.error(f"Failed to connect to MongoDB: {e}")
@@ -2,14 +2,23 @@ import argparse
 import yaml
 import os
 import logging
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING
 import pandas as pd
 import numpy as np
+from numba import njit
 import sys
 from datetime import datetime
 import re
 from collections import defaultdict  # Added for tracking matches per league
 
+# Key patterns of the matches indexes; the domestic ELO query is hinted to the home one,
+# whose (competition_id, date_unix) prefix serves it without a separate two-key index
+COMPETITION_DATE_HOME_INDEX = [('competition_id', ASCENDING), ('date_unix', ASCENDING), ('homeID', ASCENDING)]
+COMPETITION_DATE_AWAY_INDEX = [('competition_id', ASCENDING), ('date_unix', ASCENDING), ('awayID', ASCENDING)]
+
+# elo_gap_bin labels are '<lower>-<upper>', e.g. '0-49' or '-50--1'
+_BIN_RE = re.compile(r'^\s*(-?\d+)-(-?\d+)\s*$')
+
 def parse_arguments():
     """
     Parse command-line arguments for configuration.
@@ -43,48 +52,89 @@ def setup_logging(log_file_path):
         ]
     )
 
-def retrieve_inter_league_matches(matches_collection, competition_ids):
+def team_competitions_lookup(teams_collection_name, team_field, output_field):
     """
-    Retrieve inter-league matches from MongoDB.
+    Build a $lookup stage joining a match's team (by id and season) to its competition IDs in the teams collection.
+    """
+    return {
+        "$lookup": {
+            "from": teams_collection_name,
+            "let": {"team_id": f"${team_field}", "season": "$season"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$id", "$$team_id"]},
+                    {"$eq": ["$season", "$$season"]}
+                ]}}},
+                {"$project": {"_id": 0, "competition_id": 1}}
+            ],
+            "as": output_field
+        }
+    }
+
+def retrieve_inter_league_matches(matches_collection, teams_collection, competition_ids):
+    """
+    Retrieve inter-league matches from MongoDB, joined server-side with the competition IDs
+    of both teams for that season. Returns a cursor to be iterated once.
     """
     try:
-        matches_cursor = matches_collection.find({"competition_id": {"$in": competition_ids}})
-        matches = list(matches_cursor)
-        logging.info(f"Retrieved {len(matches)} inter-league matches from the database.")
-        return matches
+        pipeline = [
+            {"$match": {"competition_id": {"$in": competition_ids}}},
+            team_competitions_lookup(teams_collection.name, "homeID", "home_teams"),
+            team_competitions_lookup(teams_collection.name, "awayID", "away_teams"),
+            {"$project": {
+                "_id": 0,
+                "id": 1,
+                "homeID": 1,
+                "awayID": 1,
+                "home_name": 1,
+                "away_name": 1,
+                "homeGoalCount": 1,
+                "awayGoalCount": 1,
+                "date_unix": 1,
+                "season": 1,
+                "home_competition_ids": "$home_teams.competition_id",
+                "away_competition_ids": "$away_teams.competition_id"
+            }}
+        ]
+        return matches_collection.aggregate(pipeline, allowDiskUse=True, batchSize=1000)
     except Exception as e:
         logging.error(f"Failed to retrieve inter-league matches: {e}")
-        return []
+        return None
 
-def get_team_domestic_league(teams_collection, team_id, team_name, season, combined_ids_df):
+def build_competition_lookups(combined_ids_df):
+    """
+    Index the combined IDs CSV for O(1) lookups:
+    competition_id -> (league_type, league_name) and (league_name, season) -> [competition_id, ...].
+    """
+    comp_info = dict(zip(
+        combined_ids_df['competition_id'].astype(int).tolist(),
+        zip(combined_ids_df['league_type'], combined_ids_df['league_name'])
+    ))
+    league_comps = combined_ids_df.groupby(['league_name', 'season'])['competition_id'].apply(lambda ids: ids.tolist()).to_dict()
+    return comp_info, league_comps
+
+def get_team_domestic_league(competition_ids, team_name, season, comp_info):
     """
-    Determine the domestic league for a team in a given season.
+    Determine the domestic league for a team in a given season, from the team's competition IDs.
     Uses team_name instead of team_id in logging.
     """
     try:
-        team_docs = teams_collection.find({"id": int(team_id), "season": season}, {"competition_id": 1})
-        competition_ids = [doc['competition_id'] for doc in team_docs]
         if not competition_ids:
             logging.warning(f"No competition IDs found for team '{team_name}' in season {season}.")
             return None
-        # Ensure competition_ids are integers
-        competition_ids = [int(cid) for cid in competition_ids]
         # Filter competition IDs to find domestic league
         for comp_id in competition_ids:
-            league_info = combined_ids_df[combined_ids_df['competition_id'] == comp_id]
-            if league_info.empty:
+            league_info = comp_info.get(int(comp_id))
+            if league_info is None:
                 logging.warning(f"Competition ID {comp_id} not found in combined_ids_df for team '{team_name}'.")
                 continue
-            if 'league_type' not in league_info.columns:
-                logging.error(f"'league_type' column missing in combined_ids_df for competition ID {comp_id} (Team '{team_name}').")
-                return None
-            if league_info['league_type'].iloc[0] == 'domestic':
-                league_name = league_info['league_name'].iloc[0]
+            league_type, league_name = league_info
+            if league_type == 'domestic':
                 return league_name
         logging.warning(f"Domestic league not found for team '{team_name}' in season {season}.")
         return None
     except Exception as e:
-        logging.error(f"Error finding domestic league for team '{team_name}' (ID {team_id}) in season {season}: {e}")
+        logging.error(f"Error finding domestic league for team '{team_name}' in season {season}: {e}")
         return None
 
 def compute_elo_gap(home_elo, away_elo):
@@ -93,80 +143,84 @@ def compute_elo_gap(home_elo, away_elo):
     """
     return home_elo - away_elo
 
-def compute_expected_goal_diff(elo_gap, overall_avg_goal_diffs_df):
+def parse_goal_diff_bins(overall_avg_goal_diffs_df):
     """
-    Compute the expected goal difference based on ELO gap.
+    Parse the elo_gap_bin strings once into arrays sorted by lower bound.
+    Returns (lower, upper, values).
     """
-    # Find the appropriate ELO gap bin
+    bounds = overall_avg_goal_diffs_df['elo_gap_bin'].apply(extract_lower_upper_bounds)
+    valid = bounds.apply(lambda b: b != (None, None))
+    if not valid.all():
+        logging.warning(f"Skipping {(~valid).sum()} ELO gap bins with invalid bounds.")
+    lower = np.array([b[0] for b in bounds[valid]], dtype=np.float64)
+    upper = np.array([b[1] for b in bounds[valid]], dtype=np.float64)
+    values = overall_avg_goal_diffs_df.loc[valid, 'avg_goal_diff'].to_numpy(dtype=np.float64)
+    order = np.argsort(lower)
+    return lower[order], upper[order], values[order]
+
+def compute_expected_goal_diff(elo_gaps, goal_diff_bins):
+    """
+    Compute the expected goal difference for an array of ELO gaps, given the
+    (lower, upper, values) arrays from parse_goal_diff_bins.
+    Each gap is matched to the bin with the largest lower bound not above it;
+    gaps outside the range use the closest bin.
+    """
+    elo_gaps = np.asarray(elo_gaps, dtype=np.float64)
     try:
-        bins = overall_avg_goal_diffs_df['elo_gap_bin']
-        elo_gap_bins = bins.apply(extract_lower_upper_bounds)
-        for idx, bounds in elo_gap_bins.iteritems():  # Changed from iteritems() to items()
-            logging.debug(f"Processing bin {idx}: bounds {bounds}")
-            if bounds is None or bounds == (None, None):
-                logging.warning(f"Bin {idx} has invalid bounds. Skipping.")
-                continue
-            lower, upper = bounds
-            logging.debug(f"Lower bound: {lower}, Upper bound: {upper}")
-            if lower <= elo_gap <= upper:
-                expected_goal_diff = overall_avg_goal_diffs_df.loc[idx, 'avg_goal_diff']
-                logging.debug(f"Matched bin {idx}: expected_goal_diff={expected_goal_diff}")
-                return expected_goal_diff
-        
-        # If ELO gap is outside the range, use the closest bin
-        if elo_gap < elo_gap_bins.iloc[0][0]:
-            expected_goal_diff = overall_avg_goal_diffs_df['avg_goal_diff'].iloc[0]
-            logging.debug(f"ELO gap below all bins: expected_goal_diff={expected_goal_diff}")
-            return expected_goal_diff
-        else:
-            expected_goal_diff = overall_avg_goal_diffs_df['avg_goal_diff'].iloc[-1]
-            logging.debug(f"ELO gap above all bins: expected_goal_diff={expected_goal_diff}")
-            return expected_goal_diff
+        lower, _, values = goal_diff_bins
+        idx = np.clip(np.searchsorted(lower, elo_gaps, side='right') - 1, 0, len(values) - 1)
+        return values[idx]
     except Exception as e:
-        logging.error(f"Failed to compute expected goal difference for ELO gap {elo_gap}: {e}")
-        return 0.0
+        logging.error(f"Failed to compute expected goal differences: {e}")
+        return np.zeros_like(elo_gaps)
 
 def extract_lower_upper_bounds(bin_str):
     """
     Extract the lower and upper bounds from an elo_gap_bin string using regex.
-    Handles both single and double hyphens for negative ranges.
+    Handles both single and double hyphens for negative ranges (e.g. '0-49', '-50--1').
     """
     try:
-        # Use regex to extract two integers (possibly negative)
-        matches = re.findall(r'-?\d+', bin_str)
-        if len(matches) != 2:
-            raise ValueError(f"Expected 2 numbers, found {len(matches)} in '{bin_str}'")
-        lower_str, upper_str = matches
+        match = _BIN_RE.match(bin_str)
+        if match is None:
+            raise ValueError(f"Expected '<lower>-<upper>', found '{bin_str}'")
+        lower_str, upper_str = match.groups()
         return int(lower_str), int(upper_str)
     except Exception as e:
         logging.error(f"Failed to extract bounds from elo_gap_bin '{bin_str}': {e}")
         return None, None
 
-def build_massey_matrix(data):
+@njit(cache=True, fastmath=True)
+def _assemble_massey_system(home_idx, away_idx, residual, n_leagues):
     """
-    Build Massey's matrix and vector for solving league ratings.
+    Accumulate Massey's matrix and vector from per-match league indices and residuals.
     """
-    leagues = sorted(set(data['home_league']).union(set(data['away_league'])))
-    league_indices = {league: idx for idx, league in enumerate(leagues)}
-    n_leagues = len(leagues)
-
-    # Initialize Massey's matrix and vector
     M = np.zeros((n_leagues, n_leagues))
     y = np.zeros(n_leagues)
+    for k in range(home_idx.shape[0]):
+        h = home_idx[k]
+        a = away_idx[k]
+        r = residual[k]
+        M[h, h] += 1
+        M[a, a] += 1
+        M[h, a] -= 1
+        M[a, h] -= 1
+        y[h] += r
+        y[a] -= r
+    return M, y
 
-    # Build the system of equations
-    for idx, row in data.iterrows():
-        home_idx = league_indices[row['home_league']]
-        away_idx = league_indices[row['away_league']]
-        residual = row['residual']
-
-        M[home_idx, home_idx] += 1
-        M[away_idx, away_idx] += 1
-        M[home_idx, away_idx] -= 1
-        M[away_idx, home_idx] -= 1
+def build_massey_matrix(data):
+    """
+    Build Massey's matrix and vector for solving league ratings.
+    home_league and away_league must share one CategoricalDtype; its codes index the matrix.
+    """
+    leagues = list(data['home_league'].cat.categories)
+    n_leagues = len(leagues)
 
-        y[home_idx] += residual
-        y[away_idx] -= residual
+    # Build the system of equations in a single compiled pass over all matches
+    home_idx = data['home_league'].cat.codes.to_numpy(dtype=np.int64)
+    away_idx = data['away_league'].cat.codes.to_numpy(dtype=np.int64)
+    residual = data['residual'].to_numpy(dtype=np.float64)
+    M, y = _assemble_massey_system(home_idx, away_idx, residual, n_leagues)
 
     # Impose constraint that ratings sum to zero
     M[-1, :] = 1
@@ -178,67 +232,92 @@ def solve_massey_equation(M, y):
     """
     Solve Massey's equation to find league ratings.
     """
+    M = np.asarray(M, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
     try:
-        ratings = np.linalg.lstsq(M, y, rcond=None)[0]
+        # With the sum-to-zero row imposed, M is square and normally invertible: LU solve is enough
+        ratings = np.linalg.solve(M, y)
         return ratings
+    except np.linalg.LinAlgError as e:
+        logging.warning(f"Massey's matrix is singular ({e}); falling back to least squares.")
+        try:
+            return np.linalg.lstsq(M, y, rcond=None)[0]
+        except Exception as e:
+            logging.error(f"Failed to solve Massey's equation: {e}")
+            return None
     except Exception as e:
         logging.error(f"Failed to solve Massey's equation: {e}")
         return None
 
-def get_team_elo(matches_collection, team_id, league_competition_ids, match_date_unix):
+def load_team_elo_timelines(matches_collection, competition_ids):
     """
-    Get the team's ELO either from the next domestic match after the given date,
-    or from the most recent domestic match before the given date.
+    Load every match of the given competitions in one query and build, per (team_id, competition_id),
+    date-sorted arrays of match dates and the team's pre-match ELO.
     """
-    # First, try to get the ELO from the next match after the given date
+    entries = defaultdict(list)
     try:
-        query_next = {
-            "competition_id": {"$in": league_competition_ids},
-            "date_unix": {"$gt": match_date_unix},
-            "$or": [
-                {"homeID": team_id},
-                {"awayID": team_id},
-            ]
+        projection = {
+            "competition_id": 1,
+            "homeID": 1,
+            "awayID": 1,
+            "date_unix": 1,
+            "home_elo_pre_match_HA": 1,
+            "away_elo_pre_match_HA": 1
         }
-        # Sort by date_unix ascending to get the next match after the inter-league match
-        next_match_cursor = matches_collection.find(query_next).sort("date_unix", 1).limit(1)
-        next_matches = list(next_match_cursor)
-        if next_matches:
-            match = next_matches[0]
-            if match['homeID'] == team_id:
-                # If the team is the home team, get their pre-match ELO
-                elo = float(match['home_elo_pre_match_HA'])
-            else:
-                # If the team is the away team, get their pre-match ELO
-                elo = float(match['away_elo_pre_match_HA'])
-            return elo
+        matches_cursor = matches_collection.find({"competition_id": {"$in": competition_ids}}, projection).hint(COMPETITION_DATE_HOME_INDEX)
+        for match in matches_cursor:
+            date_unix = match.get('date_unix')
+            if date_unix is None:
+                continue
+            comp_id = int(match['competition_id'])
+            for team_key, elo_key in (('homeID', 'home_elo_pre_match_HA'), ('awayID', 'away_elo_pre_match_HA')):
+                team_id = match.get(team_key)
+                elo = match.get(elo_key)
+                if team_id is None or elo is None:
+                    continue
+                try:
+                    entries[(int(team_id), comp_id)].append((int(date_unix), float(elo)))
+                except (ValueError, TypeError):
+                    logging.warning(f"Invalid ELO or date for team ID {team_id} in competition {comp_id}. Skipping.")
     except Exception as e:
-        logging.error(f"Error retrieving next ELO for team ID {team_id}: {e}")
+        logging.error(f"Failed to load domestic match ELOs: {e}")
+
+    timelines = {}
+    for key, team_entries in entries.items():
+        team_entries.sort(key=lambda entry: entry[0])
+        dates = np.array([entry[0] for entry in team_entries], dtype=np.int64)
+        elos = np.array([entry[1] for entry in team_entries], dtype=np.float64)
+        timelines[key] = (dates, elos)
+    logging.info(f"Built ELO timelines for {len(timelines)} team-competitions.")
+    return timelines
+
+def get_team_elo(team_elo_timelines, team_id, league_competition_ids, match_date_unix):
+    """
+    Get the team's ELO either from the next domestic match after the given date,
+    or from the most recent domestic match before the given date.
+    """
+    next_match = None
+    prev_match = None
+    for comp_id in league_competition_ids:
+        timeline = team_elo_timelines.get((int(team_id), int(comp_id)))
+        if timeline is None:
+            continue
+        dates, elos = timeline
 
-    # If not found, try to get the ELO from the most recent match before the given date
-    try:
-        query_prev = {
-            "competition_id": {"$in": league_competition_ids},
-            "date_unix": {"$lt": match_date_unix},
-            "$or": [
-                {"homeID": team_id},
-                {"awayID": team_id}
-            ]
-        }
-        # Sort by date_unix descending to get the most recent match before the inter-league match
-        prev_match_cursor = matches_collection.find(query_prev).sort("date_unix", -1).limit(1)
-        prev_matches = list(prev_match_cursor)
-        if prev_matches:
-            match = prev_matches[0]
-            if match['homeID'] == team_id:
-                # If the team is the home team, get their post-match ELO
-                elo = float(match['home_elo_pre_match_HA'])
-            else:
-                # If the team is the away team, get their post-match ELO
-                elo = float(match['away_elo_pre_match_HA'])
-            return elo
-    except Exception as e:
-        logging.error(f"Error retrieving previous ELO for team ID {team_id}: {e}")
+        # First match strictly after the inter-league match
+        next_idx = np.searchsorted(dates, match_date_unix, side='right')
+        if next_idx < len(dates) and (next_match is None or dates[next_idx] < next_match[0]):
+            next_match = (dates[next_idx], elos[next_idx])
+
+        # Most recent match strictly before the inter-league match
+        prev_idx = np.searchsorted(dates, match_date_unix, side='left') - 1
+        if prev_idx >= 0 and (prev_match is None or dates[prev_idx] > prev_match[0]):
+            prev_match = (dates[prev_idx], elos[prev_idx])
+
+    if next_match is not None:
+        return float(next_match[1])
+    if prev_match is not None:
+        return float(prev_match[1])
 
     # If neither is found, return None
     return None
@@ -254,6 +333,7 @@ def process_league_ratings(matches_collection, teams_collection, inter_league_co
     # Load Combined IDs CSV
     try:
         combined_ids_df = pd.read_csv(combined_ids_csv)
+        comp_info, league_comps = build_competition_lookups(combined_ids_df)
         logging.info(f"Loaded combined IDs CSV from {combined_ids_csv}.")
     except Exception as e:
         logging.error(f"Failed to read combined IDs CSV: {e}")
@@ -262,16 +342,15 @@ def process_league_ratings(matches_collection, teams_collection, inter_league_co
     # Load Overall Average Goal Differences
     try:
         overall_avg_goal_diffs_df = pd.read_csv(overall_avg_goal_diffs_file)
+        goal_diff_bins = parse_goal_diff_bins(overall_avg_goal_diffs_df)
         logging.info(f"Loaded overall average goal differences from {overall_avg_goal_diffs_file}.")
     except Exception as e:
         logging.error(f"Failed to read overall average goal differences CSV: {e}")
         return
 
-    # Retrieve Inter-League Matches
-    matches = retrieve_inter_league_matches(matches_collection, inter_league_competition_ids)
-    if not matches:
-        logging.error("No inter-league matches retrieved. Exiting.")
-        return
+    # Preload domestic ELO timelines for every league-season in the combined IDs
+    all_comp_ids = sorted({int(comp_id) for comp_ids in league_comps.values() for comp_id in comp_ids})
+    team_elo_timelines = load_team_elo_timelines(matches_collection, all_comp_ids)
 
     # Initialize counters for missing data
     missing_team_data_counter = 0
@@ -282,9 +361,17 @@ def process_league_ratings(matches_collection, teams_collection, inter_league_co
     total_matches_used = 0
     matches_per_league = defaultdict(int)
 
-    # Prepare Data
+    # Retrieve Inter-League Matches
+    matches = retrieve_inter_league_matches(matches_collection, teams_collection, inter_league_competition_ids)
+    if matches is None:
+        logging.error("No inter-league matches retrieved. Exiting.")
+        return
+
+    # Prepare Data, streaming the cursor once
     data = []
+    total_matches_retrieved = 0
     for match in matches:
+        total_matches_retrieved += 1
         match_id = match.get('id')
         season = match.get('season')
         match_date_unix = match.get('date_unix')
@@ -299,8 +386,8 @@ def process_league_ratings(matches_collection, teams_collection, inter_league_co
             away_team_name = match.get('away_name', f"AwayTeam{away_team_id}")  # Fallback if name missing
 
             # Get domestic leagues
-            home_league = get_team_domestic_league(teams_collection, home_team_id, home_team_name, season, combined_ids_df)
-            away_league = get_team_domestic_league(teams_collection, away_team_id, away_team_name, season, combined_ids_df)
+            home_league = get_team_domestic_league(match.get('home_competition_ids'), home_team_name, season, comp_info)
+            away_league = get_team_domestic_league(match.get('away_competition_ids'), away_team_name, season, comp_info)
 
             if home_league is None or away_league is None:
                 if home_league is None:
@@ -311,15 +398,8 @@ def process_league_ratings(matches_collection, teams_collection, inter_league_co
                 continue
 
             # Get competition IDs for domestic leagues
-            home_league_comp_ids = combined_ids_df[
-                (combined_ids_df['league_name'] == home_league) &
-                (combined_ids_df['season'] == season)
-            ]['competition_id'].tolist()
-
-            away_league_comp_ids = combined_ids_df[
-                (combined_ids_df['league_name'] == away_league) &
-                (combined_ids_df['season'] == season)
-            ]['competition_id'].tolist()
+            home_league_comp_ids = league_comps.get((home_league, season), [])
+            away_league_comp_ids = league_comps.get((away_league, season), [])
 
             if not home_league_comp_ids or not away_league_comp_ids:
                 logging.warning(f"Competition IDs not found for leagues '{home_league}' or '{away_league}'. Skipping match ID {match_id}.")
@@ -327,8 +407,8 @@ def process_league_ratings(matches_collection, teams_collection, inter_league_co
                 continue
 
             # Get ELOs for the teams
-            home_elo = get_team_elo(matches_collection, home_team_id, home_league_comp_ids, match_date_unix)
-            away_elo = get_team_elo(matches_collection, away_team_id, away_league_comp_ids, match_date_unix)
+            home_elo = get_team_elo(team_elo_timelines, home_team_id, home_league_comp_ids, match_date_unix)
+            away_elo = get_team_elo(team_elo_timelines, away_team_id, away_league_comp_ids, match_date_unix)
 
             if home_elo is None or away_elo is None:
                 logging.warning(f"ELOs not found for teams '{home_team_name}' or '{away_team_name}' in match ID {match_id}. Skipping match.")
@@ -339,14 +419,13 @@ def process_league_ratings(matches_collection, teams_collection, inter_league_co
             away_goals = int(match['awayGoalCount'])
             goal_diff = home_goals - away_goals
             elo_gap = compute_elo_gap(home_elo, away_elo)
-            expected_goal_diff = compute_expected_goal_diff(elo_gap, overall_avg_goal_diffs_df)
-            residual = goal_diff - expected_goal_diff
 
             data.append({
                 'match_id': match_id,
                 'home_league': home_league,
                 'away_league': away_league,
-                'residual': residual
+                'goal_diff': goal_diff,
+                'elo_gap': elo_gap
             })
 
             # Update match counters
@@ -363,6 +442,11 @@ def process_league_ratings(matches_collection, teams_collection, inter_league_co
             missing_team_data_counter += 1
             continue
 
+    logging.info(f"Retrieved {total_matches_retrieved} inter-league matches from the database.")
+    if total_matches_retrieved == 0:
+        logging.error("No inter-league matches retrieved. Exiting.")
+        return
+
     if not data:
         logging.error("No valid data to process. Exiting.")
         logging.info(f"Total matches skipped due to missing team data: {missing_team_data_counter}")
@@ -373,6 +457,14 @@ def process_league_ratings(matches_collection, teams_collection, inter_league_co
     df = pd.DataFrame(data)
     logging.info(f"Prepared DataFrame with {len(df)} valid matches.")
 
+    # Residuals against the expected goal difference, resolved for all matches at once
+    df['residual'] = df['goal_diff'] - compute_expected_goal_diff(df['elo_gap'].to_numpy(), goal_diff_bins)
+
+    # Encode leagues once as a shared categorical so their codes index Massey's matrix directly
+    leagues_cat = pd.CategoricalDtype(sorted(set(df['home_league']).union(df['away_league'])))
+    df['home_league'] = df['home_league'].astype(leagues_cat)
+    df['away_league'] = df['away_league'].astype(leagues_cat)
+
     # Build and Solve Massey's Equation
     M, y, leagues = build_massey_matrix(df)
     ratings = solve_massey_equation(M, y)
@@ -399,7 +491,9 @@ def process_league_ratings(matches_collection, teams_collection, inter_league_co
     try:
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
         league_ratings.to_csv(output_file, index=False)
-        logging.info(f"League ratings saved to {output_file}.")
+        parquet_file = os.path.splitext(output_file)[0] + '.parquet'
+        league_ratings.to_parquet(parquet_file, engine='pyarrow', compression='zstd', index=False)
+        logging.info(f"League ratings saved to {output_file} and {parquet_file}.")
     except Exception as e:
         logging.error(f"Failed to save league ratings to {output_file}: {e}")
 
@@ -449,6 +543,9 @@ def main():
         db = client[DATABASE_NAME]
         matches_collection = db[MATCHES_COLLECTION_NAME]
         teams_collection = db[TEAMS_COLLECTION_NAME]
+        matches_collection.create_index(COMPETITION_DATE_HOME_INDEX, background=True)
+        matches_collection.create_index(COMPETITION_DATE_AWAY_INDEX, background=True)
+        teams_collection.create_index([('id', ASCENDING), ('season', ASCENDING)], background=True)
         logging.info(f"Connected to MongoDB at {MONGO_URI}, database: {DATABASE_NAME}, collections: {MATCHES_COLLECTION_NAME}, {TEAMS_COLLECTION_NAME}.")
     except Exception as e:
         logging.error(f"Failed to connect to MongoDB: {e}")
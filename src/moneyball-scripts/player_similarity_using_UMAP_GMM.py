@@ -1,10 +1,18 @@
+import argparse
 import pymongo
 import pandas as pd
 import numpy as np
+import joblib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import umap.umap_ as umap
 from sklearn.preprocessing import StandardScaler, MinMaxScaler
 from sklearn.mixture import GaussianMixture
 
+parser = argparse.ArgumentParser(description='Forward player similarity via UMAP embeddings and GMM clustering')
+parser.add_argument('--emit-xlsx', action='store_true', help='Also write the clustered players to an Excel workbook')
+args = parser.parse_args()
+
 # --- 1. Connect to MongoDB and Query Players ---
 client = pymongo.MongoClient('mongodb://localhost:27017')
 db = client.footballDB
@@ -15,7 +23,6 @@ competition_ids = [12325, 12337, 12529]
 
 # Query only forwards from these competitions
 query = {"competition_id": {"$in": competition_ids}, "position": "Forward"}
-cursor = players_collection.find(query)
 
 # --- 2. Define Required Metrics and Their Aspects ---
 # List of all required metrics (from your CSV)
@@ -89,82 +96,85 @@ metric_sign = {
     "minutes_played_overall": 1
 }
 
-# --- 3. Helper Function to Retrieve Nested Values ---
-def get_nested_value(doc, key):
-    """Traverse a document using dot notation and return the value (or None if missing)."""
-    keys = key.split('.')
-    value = doc
-    for k in keys:
-        if isinstance(value, dict) and k in value:
-            value = value[k]
-        else:
-            return None
-    return value
+# --- 3. Project Only the Required Fields ---
+# Dotted paths keep only the needed leaves of the "detailed" subdocument on the wire
+player_fields = ["id", "competition_id", "position", "age", "known_as", "club_team_id", "minutes_played_overall"]
+projection = {m: 1 for m in metrics} | {f: 1 for f in player_fields} | {"_id": 0}
+cursor = players_collection.find(query, projection).batch_size(500)
 
 # --- 4. Load Players into a DataFrame and Filter ---
-players_data = []
-for player in cursor:
-    # Ensure all required metrics and age are present (assume player's age is stored under "age")
-    if any(get_nested_value(player, m) is None for m in metrics) or player.get('age') is None:
-        continue
-    record = {
-        "id": player.get("id"),
-        "competition_id": player.get("competition_id"),
-        "position": player.get("position"),
-        "age": player.get("age"),
-        "Player_Name": player.get("known_as", "Unknown Player"),
-        "club_id": player.get("club_team_id", "Unknown Player"),
-        "minutes": player.get("minutes_played_overall", 0)
-        
-    }
-    # Add each metric value
-    for m in metrics:
-        record[m] = get_nested_value(player, m)
-    players_data.append(record)
-
-df = pd.DataFrame(players_data)
-df.dropna(inplace=True)  # Drop any rows with missing values, just to be safe
+player_docs = list(cursor)
+# The client is not needed past this point; closing it stops its monitor threads before the worker fork
+client.close()
+players = pd.json_normalize(player_docs, sep='.')
+players = players.reindex(columns=list(dict.fromkeys(player_fields + metrics)))
+
+# json_normalize turns absent and null fields alike into NaN; an absent name or club gets a default below,
+# while an explicit null still drops the player
+null_field = np.zeros(len(players), dtype=bool)
+for field in ("known_as", "club_team_id"):
+    present = np.fromiter((field in doc for doc in player_docs), dtype=bool, count=len(player_docs))
+    null_field |= present & players[field].isna().to_numpy()
+players = players[~null_field]
+
+# Ensure all required metrics and age are present (assume player's age is stored under "age")
+players = players.dropna(subset=metrics + ['age'])
+
+df = pd.concat([
+    pd.DataFrame({
+        # Integer IDs come back as float64 once any fetched document lacks them; restore the integers
+        "id": players["id"].astype('Int64'),
+        "competition_id": players["competition_id"].astype('Int64'),
+        "position": players["position"],
+        "age": players["age"],
+        "Player_Name": players["known_as"].fillna("Unknown Player"),
+        "club_id": players["club_team_id"].astype('Int64'),
+        "minutes": players["minutes_played_overall"].fillna(0)
+    }),
+    players[metrics]
+], axis=1)
+# Drop any rows with missing values, just to be safe; club_id stays <NA> for players without a club,
+# as a nullable integer so the Parquet column keeps one type
+df.dropna(subset=df.columns.drop('club_id'), inplace=True)
+
+# Downstream scaling, UMAP and GMM all work in float32; halve the bytes they stream through
+num_cols = metrics + ['age']
+df[num_cols] = df[num_cols].astype(np.float32)
 print("DataFrame shape after filtering:", df.shape)
 
 # --- 5. Encode Age ---
 def encode_age(age):
-    if age < 24:
-        return 3
-    elif 24 <= age < 29:
-        return 2
-    else:
-        return 1
+    # 3 for under-24s, 2 for 24-28, 1 for 29 and over, evaluated on the whole array at once
+    return np.select([age < 24, age < 29], [3, 2], default=1)
 
-df['age_encoded'] = df['age'].apply(encode_age)
+df['age_encoded'] = encode_age(df['age'].to_numpy())
 
 # --- 6. Compute Aspect Scores and Overall Score ---
-for aspect, feats in aspect_metrics.items():
-    col_name = aspect + "_score"
-    df[col_name] = 0
+# Signed weight matrix W (metrics x aspects): W[i, j] = metric_sign[metric_i] if metric_i belongs to aspect_j, else 0
+aspect_score_cols = [aspect + "_score" for aspect in aspect_metrics]
+W = np.zeros((len(metrics), len(aspect_metrics)), dtype=np.float32)
+for j, feats in enumerate(aspect_metrics.values()):
     for feat in feats:
-        df[col_name] += df[feat] * metric_sign[feat]
+        W[metrics.index(feat), j] = metric_sign[feat]
+
+scores = df[metrics].to_numpy(dtype=np.float32) @ W
+df[aspect_score_cols] = scores
 
 # Overall score as average of the four aspect scores
-df['overall_score'] = (
-    df['passing_ability_score'] +
-    df['finishing_ability_score'] +
-    df['on_the_ball_ability_score'] +
-    df['off_the_ball_ability_score']
-) / 4
+df['overall_score'] = scores.mean(axis=1)
 
 # --- 7. UMAP Embedding for Each Aspect ---
-# We'll mimic the research approach by scaling positive and negative features separately
-def aspect_umap(df, positive_features, negative_features):
-    # Subset the data for this aspect
-    data_subset = df[positive_features + negative_features].copy()
-    
-    # Scale positive features with StandardScaler
-    pos_scaler = StandardScaler()
-    pos_scaled = pos_scaler.fit_transform(data_subset[positive_features])
-    
-    # Scale negative features with MinMaxScaler, then invert (1 - value)
-    neg_scaler = MinMaxScaler()
-    neg_scaled = neg_scaler.fit_transform(data_subset[negative_features])
+# UMAP and GMM fits are memoized on disk, keyed on their input arrays, so re-runs on unchanged data skip them
+memory = joblib.Memory('/root/moneyball/.cache', verbose=0)
+
+@memory.cache
+def umap_embedding(features_for_umap):
+    reducer = umap.UMAP(random_state=42, low_memory=True)
+    return reducer.fit_transform(features_for_umap)
+
+# We'll mimic the research approach by scaling positive and negative features separately:
+# positive features are standard-scaled, negative features min-max scaled then inverted (1 - value)
+def aspect_umap(pos_scaled, neg_scaled):
     neg_scaled_inverted = 1 - neg_scaled
     
     # Compute weighted scores: use the mean of positive and negative parts, then multiply them
@@ -177,9 +187,7 @@ def aspect_umap(df, positive_features, negative_features):
     features_for_umap = np.concatenate((pos_scaled, neg_scaled_inverted, weighted_scores), axis=1)
     
     # Apply UMAP to reduce to 2 dimensions
-    reducer = umap.UMAP(random_state=42)
-    umap_embedding = reducer.fit_transform(features_for_umap)
-    return umap_embedding
+    return umap_embedding(features_for_umap)
 
 # Define positive and negative features for each aspect based on our CSV:
 # Passing and Finishing: all features are positive.
@@ -216,53 +224,72 @@ off_ball_neg = [
 ]
 
 # For aspects with only positive features, simply scale them and apply UMAP
-def simple_umap(df, features):
-    scaler = StandardScaler()
-    scaled = scaler.fit_transform(df[features])
-    reducer = umap.UMAP(random_state=42)
-    return reducer.fit_transform(scaled)
-
-# Create UMAP embeddings for each aspect:
-umap_passing = simple_umap(df, passing_pos)
-df['UMAP_Passing1'] = umap_passing[:, 0]
-df['UMAP_Passing2'] = umap_passing[:, 1]
-
-umap_finishing = simple_umap(df, finishing_pos)
-df['UMAP_Finishing1'] = umap_finishing[:, 0]
-df['UMAP_Finishing2'] = umap_finishing[:, 1]
-
-umap_on_ball = aspect_umap(df, on_ball_pos, on_ball_neg)
-df['UMAP_OnBall1'] = umap_on_ball[:, 0]
-df['UMAP_OnBall2'] = umap_on_ball[:, 1]
-
-umap_off_ball = aspect_umap(df, off_ball_pos, off_ball_neg)
-df['UMAP_OffBall1'] = umap_off_ball[:, 0]
-df['UMAP_OffBall2'] = umap_off_ball[:, 1]
-
-# Optionally, create an overall UMAP embedding using the four aspect scores and overall_score.
+def simple_umap(scaled):
+    return umap_embedding(scaled)
+
+# The overall embedding uses the four aspect scores and overall_score.
 overall_features = ['passing_ability_score', 'finishing_ability_score', 'on_the_ball_ability_score', 'off_the_ball_ability_score', 'overall_score']
-scaler_overall = StandardScaler()
-overall_data = scaler_overall.fit_transform(df[overall_features])
-umap_overall = umap.UMAP(random_state=42).fit_transform(overall_data)
-df['UMAP_Overall1'] = umap_overall[:, 0]
-df['UMAP_Overall2'] = umap_overall[:, 1]
+
+# Scale every column once; each aspect slices its columns out of these two matrices
+scaled_cols = metrics + overall_features
+col_index = {col: i for i, col in enumerate(scaled_cols)}
+raw_values = df[scaled_cols].to_numpy(dtype=np.float32)
+X = StandardScaler().fit_transform(raw_values)
+X_mm = MinMaxScaler().fit_transform(raw_values)
+
+def columns(matrix, features):
+    return matrix[:, [col_index[f] for f in features]]
 
 # --- 8. Cluster Each UMAP Embedding Using GMM ---
+@memory.cache
 def apply_gmm(umap_embedding, n_components=3):
-    gmm = GaussianMixture(n_components=n_components, covariance_type='full', random_state=42)
+    # Diagonal covariances are cheaper per EM step and sufficient for 2-D embeddings
+    gmm = GaussianMixture(
+        n_components=n_components,
+        covariance_type='diag',
+        n_init=1,
+        max_iter=50,
+        init_params='k-means++',
+        random_state=42
+    )
     return gmm.fit_predict(umap_embedding)
 
-df['Cluster_Passing'] = apply_gmm(umap_passing)
-df['Cluster_Finishing'] = apply_gmm(umap_finishing)
-df['Cluster_OnBall'] = apply_gmm(umap_on_ball)
-df['Cluster_OffBall'] = apply_gmm(umap_off_ball)
-df['Cluster_Overall'] = apply_gmm(umap_overall)
+# Each aspect is embedded and clustered independently, so they run in parallel worker processes
+def compute_aspect(job):
+    aspect_name, pos_scaled, neg_scaled = job
+    if neg_scaled is not None:
+        embedding = aspect_umap(pos_scaled, neg_scaled)
+    else:
+        embedding = simple_umap(pos_scaled)
+    return aspect_name, embedding, apply_gmm(embedding)
+
+aspect_jobs = [
+    ("Passing", passing_pos, []),
+    ("Finishing", finishing_pos, []),
+    ("OnBall", on_ball_pos, on_ball_neg),
+    ("OffBall", off_ball_pos, off_ball_neg),
+    ("Overall", overall_features, []),
+]
+jobs = [(name, columns(X, pos), columns(X_mm, neg) if neg else None) for name, pos, neg in aspect_jobs]
+
+# This script runs at module level, so workers are forked rather than spawned (spawning would re-run it)
+with ProcessPoolExecutor(max_workers=len(jobs), mp_context=multiprocessing.get_context('fork')) as executor:
+    results = list(executor.map(compute_aspect, jobs))
+
+for aspect_name, embedding, _ in results:
+    df[f'UMAP_{aspect_name}1'] = embedding[:, 0]
+    df[f'UMAP_{aspect_name}2'] = embedding[:, 1]
+for aspect_name, _, cluster_labels in results:
+    df[f'Cluster_{aspect_name}'] = cluster_labels
 
 # --- 9. Final Output ---
 print("Final DataFrame with UMAP embeddings and clusters:")
 print(df.head())
 
 # Optionally, save the DataFrame for further analysis
-df.to_csv("/root/moneyball/data/profiles/Forward/metrics/forward_players_clustered.csv", index=False)
-df.to_excel("/root/moneyball/data/profiles/Forward/metrics/forward_players_clustered.xlsx", index=False)
+output_base = "/root/moneyball/data/profiles/Forward/metrics/forward_players_clustered"
+df.to_csv(output_base + ".csv", index=False)
+df.to_parquet(output_base + ".parquet", engine='pyarrow', compression='zstd', index=False)
+if args.emit_xlsx:
+    df.to_excel(output_base + ".xlsx", index=False, engine='xlsxwriter')
 
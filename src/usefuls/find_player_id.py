@@ -1,6 +1,84 @@
 import argparse
+import functools
 import pymongo
 
+# Equality search fields first, then the projected known_as/id
+PLAYER_SEARCH_INDEX = [
+    ("competition_id", pymongo.ASCENDING),
+    ("club_team_id", pymongo.ASCENDING),
+    ("age", pymongo.ASCENDING),
+    ("last_name", pymongo.ASCENDING),
+    ("known_as", pymongo.ASCENDING),
+    ("id", pymongo.ASCENDING)
+]
+PLAYER_SEARCH_INDEX_NAME = "player_search_idx"
+
+# Result caps used when no --limit is given; known_as is close to unique
+DEFAULT_LIMIT = 50
+KNOWN_AS_LIMIT = 5
+
+# Query shapes that match a leading prefix of the search index; these are hinted straight to it
+# instead of letting the planner race candidate plans for every new combination of fields
+PLAN_TABLE = {
+    frozenset(["competition_id"]): PLAYER_SEARCH_INDEX_NAME,
+    frozenset(["competition_id", "club_team_id"]): PLAYER_SEARCH_INDEX_NAME,
+    frozenset(["competition_id", "club_team_id", "age"]): PLAYER_SEARCH_INDEX_NAME,
+    frozenset(["competition_id", "club_team_id", "age", "last_name"]): PLAYER_SEARCH_INDEX_NAME,
+    frozenset(["competition_id", "club_team_id", "age", "last_name", "known_as"]): PLAYER_SEARCH_INDEX_NAME
+}
+
+@functools.lru_cache(maxsize=None)
+def get_client():
+    # One pooled client per process, so repeated main() calls share its connections
+    return pymongo.MongoClient("mongodb://localhost:27017", maxPoolSize=50, minPoolSize=5, serverSelectionTimeoutMS=5000)
+
+def build_query(ln=None, ka=None, tid=None, cid=None, age=None):
+    # Build the query from every search field that was provided (0 is a valid ID or age)
+    fields = {"last_name": ln, "known_as": ka, "club_team_id": tid, "competition_id": cid, "age": age}
+    return {field: value for field, value in fields.items() if value is not None}
+
+@functools.lru_cache(maxsize=None)
+def get_players_collection():
+    # Connect to MongoDB once per process; lookups only need read access
+    client = get_client()
+    db = client.footballDB
+    return db.players
+
+def create_player_search_index():
+    # One-off setup (--create-index), kept off the lookup path since it needs createIndex privileges.
+    # Holds every searchable field plus the projected ones, so matching queries are covered by the index alone
+    get_players_collection().create_index(PLAYER_SEARCH_INDEX, name=PLAYER_SEARCH_INDEX_NAME)
+
+def resolve_limit(query, limit=None):
+    # The explicit limit if given, otherwise the default cap for this query
+    if limit is None:
+        limit = KNOWN_AS_LIMIT if "known_as" in query else DEFAULT_LIMIT
+    return limit
+
+def find_players(query, limit=None):
+    # Query the players collection for matching players,
+    # projecting only 'id' and 'known_as' (excluding _id)
+    limit = resolve_limit(query, limit)
+    projection = {"id": 1, "known_as": 1, "_id": 0}
+
+    def run(index_name=None):
+        # Matching the batch size to the limit lets the server stop early and answer in one round trip
+        cursor = get_players_collection().find(query, projection).limit(limit).batch_size(limit).max_time_ms(1000)
+        if index_name is not None:
+            cursor = cursor.hint(index_name)
+        return list(cursor)
+
+    index_name = PLAN_TABLE.get(frozenset(query))
+    if index_name is not None:
+        try:
+            return run(index_name)
+        except pymongo.errors.ExecutionTimeout:
+            raise
+        except pymongo.errors.OperationFailure:
+            # The hinted index has not been created (see --create-index); let the planner choose instead
+            pass
+    return run()
+
 def main():
     parser = argparse.ArgumentParser(description="Fetch players from the database based on search criteria.")
     parser.add_argument("--ln", type=str, help="Player's last name")
@@ -8,39 +86,34 @@ def main():
     parser.add_argument("--tid", type=int, help="Player's club team ID")
     parser.add_argument("--cid", type=int, help="Competition ID (name of the competition)")
     parser.add_argument("--age", type=int, help="Player's age")
+    parser.add_argument("--limit", type=int, help=f"Maximum number of players to return (default {KNOWN_AS_LIMIT} with --ka, otherwise {DEFAULT_LIMIT})")
+    parser.add_argument("--create-index", action="store_true", help="Create the player search index (one-off setup, needs createIndex privileges)")
     args = parser.parse_args()
 
+    query = build_query(args.ln, args.ka, args.tid, args.cid, args.age)
+
+    if args.create_index:
+        create_player_search_index()
+        print(f"Created index {PLAYER_SEARCH_INDEX_NAME} on footballDB.players.")
+        if not query:
+            return
+
     # Ensure at least one argument is provided
-    if not (args.ln or args.ka or args.tid is not None or args.cid or args.age is not None):
+    if not query:
         parser.error("At least one search parameter (--ln, --ka, --tid, --cid, or --age) must be provided.")
+    if args.limit is not None and args.limit < 1:
+        parser.error("--limit must be a positive integer.")
 
-    # Build the query based on the provided arguments
-    query = {}
-    if args.ln:
-        query["last_name"] = args.ln
-    if args.ka:
-        query["known_as"] = args.ka
-    if args.tid is not None:
-        query["club_team_id"] = args.tid
-    if args.cid:
-        query["competition_id"] = args.cid
-    if args.age is not None:
-        query["age"] = args.age
-
-    # Connect to MongoDB
-    client = pymongo.MongoClient("localhost", 27017)
-    db = client.footballDB
-    collection = db.players
-
-    # Query the players collection for matching players,
-    # projecting only 'id' and 'known_as' (excluding _id)
-    projection = {"id": 1, "known_as": 1, "_id": 0}
-    players = collection.find(query, projection)
+    limit = resolve_limit(query, args.limit)
+    players = find_players(query, limit)
 
     # Print out the matching players
     print("Matching Players:")
     for player in players:
         print(player)
+    # A full page means there may be more matches beyond the cap
+    if len(players) == limit:
+        print(f"Showing the first {limit} matches; use --limit to see more.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,67 @@
+import json
+import sys
+
+import pymongo.errors
+
+from find_player_id import build_query, find_players, resolve_limit
+
+# Long-lived lookup loop: the interpreter, pymongo and the pooled client are set up once,
+# then each stdin line is a JSON query such as {"ln": "Saka", "tid": 59}, with an optional "limit",
+# answered with {"players": [...]} (plus a "notice" when the limit was reached) or {"error": ...}
+# Expected type of each search value, matching the argparse types of the CLI
+SEARCH_KEYS = {"ln": str, "ka": str, "tid": int, "cid": int, "age": int}
+TYPE_NAMES = {str: "a string", int: "an integer"}
+
+def invalid_search_key(request):
+    # The first provided search key whose value has the wrong type, or None
+    for key, expected in SEARCH_KEYS.items():
+        value = request.get(key)
+        # bool is a subclass of int but never a valid ID or age
+        if value is not None and (not isinstance(value, expected) or isinstance(value, bool)):
+            return key
+    return None
+
+def main():
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            print(json.dumps({"error": f"Invalid JSON: {e}"}), flush=True)
+            continue
+        if not isinstance(request, dict):
+            print(json.dumps({"error": "Query must be a JSON object"}), flush=True)
+            continue
+
+        bad_key = invalid_search_key(request)
+        if bad_key is not None:
+            print(json.dumps({"error": f"{bad_key} must be {TYPE_NAMES[SEARCH_KEYS[bad_key]]}"}), flush=True)
+            continue
+
+        query = build_query(**{key: request.get(key) for key in SEARCH_KEYS})
+        if not query:
+            print(json.dumps({"error": f"At least one of {', '.join(SEARCH_KEYS)} must be provided"}), flush=True)
+            continue
+
+        limit = request.get("limit")
+        if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 1):
+            print(json.dumps({"error": "limit must be a positive integer"}), flush=True)
+            continue
+
+        # One JSON object of matching players per query line; database errors are reported, not fatal
+        limit = resolve_limit(query, limit)
+        try:
+            players = find_players(query, limit)
+        except pymongo.errors.PyMongoError as e:
+            print(json.dumps({"error": f"Query failed: {e}"}), flush=True)
+            continue
+        response = {"players": players}
+        # A full page means there may be more matches beyond the cap
+        if len(players) == limit:
+            response["notice"] = f"Showing the first {limit} matches; pass a larger \"limit\" to see more"
+        print(json.dumps(response), flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,101 +1,114 @@
-from pymongo import MongoClient, DESCENDING
-from pymongo.errors import ConnectionFailure, OperationFailure
+import argparse
+import functools
+import sys
+import numpy as np
+from pymongo import MongoClient, ASCENDING
+from pymongo.errors import ConnectionFailure, NetworkTimeout, OperationFailure
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+# Built once at import: the tuple feeds the $in filters, the frozenset any Python-side membership checks
+TEAM_IDS = (152, 59, 143, 144, 271, 251, 153, 93, 145, 218, 223, 209, 151, 149, 162, 211, 92, 148, 158, 157)
+TEAM_ID_SET = frozenset(TEAM_IDS)
+
+# One record per team per game; missing pre-match ELOs are stored as NaN
+MATCH_DTYPE = np.dtype([("game_week", "i2"), ("elo", "f4"), ("team_id", "i4")])
+
+@functools.lru_cache(maxsize=None)
+def get_client():
+    # One pooled client per process, reused by every query_matches() call
+    # Replace the URI string with your MongoDB deployment's connection string.
+    # For a local MongoDB instance:
+    return MongoClient('mongodb://localhost:27017/', maxPoolSize=50, minPoolSize=5, serverSelectionTimeoutMS=5000)
+
+@functools.lru_cache(maxsize=None)
+def get_matches_collection():
+    db = get_client()['footballDB']      # Replace with your database name
+    # Access the 'matches' collection, returning raw BSON so fields are only decoded when read
+    return db.get_collection('matches', codec_options=CodecOptions(document_class=RawBSONDocument))
+
+def create_match_indexes():
+    # One-off setup (--create-indexes), kept out of query_matches() so queries need only read access
+    collection = get_matches_collection()
+    # One index per $or branch, so both home and away matches are found by index seeks
+    collection.create_index([("competition_id", ASCENDING), ("homeID", ASCENDING), ("game_week", ASCENDING)])
+    collection.create_index([("competition_id", ASCENDING), ("awayID", ASCENDING), ("game_week", ASCENDING)])
 
 def query_matches():
     try:
-        # 1. Establish a Connection to MongoDB
-        # Replace the URI string with your MongoDB deployment's connection string.
-        # For a local MongoDB instance:
-        client = MongoClient('mongodb://localhost:27017/', serverSelectionTimeoutMS=5000)
-        
-        # Attempt to connect to the server to trigger potential connection errors
-        client.admin.command('ping')
-        print("Connected to MongoDB successfully.")
-        
-        # 2. Access the Database and Collection
-        db = client['footballDB']      # Replace with your database name
-        collection = db['matches']             # Access the 'matches' collection
-        TEAM_ID = [
-            152,
-            59,
-            143,
-            144,
-            271,
-            251,
-            153,
-            93,
-            145,
-            218,
-            223,
-            209,
-            151,
-            149,
-            162,
-            211,
-            92, 
-            148,
-            158,
-            157
-]
-        for ids in TEAM_ID:
-            # 3. Define the Query Filter
-            query_filter_1 = {
-                "homeID": ids,
-                "competition_id": 9660
-            }
-            
-            query_filter_2 = {
-                "awayID": ids,
-                "competition_id": 9660
-            }
-            
-            projection_2 = {
-                "away_elo_pre_match": 1,
-                "game_week": 1,
-                "away_name": 1,
-                "_id": 0
-            }
+        # 1. Access the Database and Collection
+        # Server selection happens on the first real operation and raises ConnectionFailure
+        # (ServerSelectionTimeoutError) once serverSelectionTimeoutMS expires
+        collection = get_matches_collection()
 
-            projection_1 = {
-                "home_elo_pre_match": 1,
+        # 2. Build a Single Aggregation for All Teams
+        # Each match is split into its home and away sides so it counts towards both teams
+        pipeline = [
+            {"$match": {
+                "competition_id": 9660,
+                "$or": [
+                    {"homeID": {"$in": TEAM_IDS}},
+                    {"awayID": {"$in": TEAM_IDS}}
+                ]
+            }},
+            {"$project": {
+                "_id": 0,
                 "game_week": 1,
-                "home_name": 1,
-                "_id": 0
-            }
-            
-            
-            # 5. Define the Sort Order
-            sort_order = [("game_week", DESCENDING)]  # Sort by 'game_week' descending
-            
-            # 6. Execute the Query
-            results_home = collection.find(query_filter_1, projection_1).sort(sort_order)
-            results_home = list(results_home)
-            results_away = collection.find(query_filter_2, projection_2).sort(sort_order)
-            results_away = list(results_away)
-            
-            combined_matches = results_home + results_away
-            
-            combined_matches_sorted = sorted(combined_matches, key=lambda x: x['game_week'], reverse=False)
-            # 9. Store Results in a Single Dictionary Key
+                "sides": [
+                    {"team_id": "$homeID", "name": "$home_name", "elo": "$home_elo_pre_match"},
+                    {"team_id": "$awayID", "name": "$away_name", "elo": "$away_elo_pre_match"}
+                ]
+            }},
+            {"$unwind": "$sides"},
+            {"$match": {"sides.team_id": {"$in": TEAM_IDS}}},
+            {"$sort": {"sides.team_id": 1, "game_week": 1}},
+            {"$group": {
+                "_id": "$sides.team_id",
+                "games": {"$push": {"gw": "$game_week", "elo": "$sides.elo", "name": "$sides.name"}}
+            }}
+        ]
+
+        # 3. Execute the Aggregation
+        # At most one grouped document per team, so a batch of len(TEAM_IDS) returns everything in the first round trip
+        cursor = collection.aggregate(pipeline, allowDiskUse=False, batchSize=len(TEAM_IDS))
+        games_by_team = {doc["_id"]: doc["games"] for doc in cursor}
+
+        missing = TEAM_ID_SET.difference(games_by_team)
+        if missing:
+            print(f"No matches found for team IDs: {sorted(missing)}")
+
+        # 4. Collect the Results, then write them out in one go
+        get = RawBSONDocument.get
+        output = []
+        rows = []
+        for ids in TEAM_IDS:
+            games = games_by_team.get(ids, [])
+
+            # Single pass over the games, with the document get bound locally
+            team_name, elos = [], []
+            for game in games:
+                elo = get(game, 'elo')
+                team_name.append(get(game, 'name'))
+                elos.append(elo)
+                rows.append((get(game, 'gw'), np.nan if elo is None else elo, ids))
+            output.append(str(team_name))
+            output.append(str(elos))
+        sys.stdout.write("\n".join(output) + "\n")
 
-            # 10. Display the Results
-            team_name = [match.get('home_name') for match in combined_matches_sorted]
-            elos = [match.get('home_elo_pre_match') or match.get('away_elo_pre_match') for match in combined_matches_sorted]
-            print(team_name)
-            print(elos)
+        # 5. Column-oriented copy of every team's games for downstream numeric analysis
+        return np.array(rows, dtype=MATCH_DTYPE)
 
-            
-        
+    except NetworkTimeout as e:
+        print(f"MongoDB network operation timed out: {e}")
     except ConnectionFailure:
         print("Failed to connect to MongoDB. Please check your connection settings.")
     except OperationFailure as e:
         print(f"MongoDB operation failed: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-    finally:
-        # 8. Close the Connection
-        client.close()
-        print("MongoDB connection closed.")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the pre-match ELOs of the tracked teams.")
+    parser.add_argument("--create-indexes", action="store_true", help="Create the match indexes first (one-off setup, needs createIndex privileges)")
+    args = parser.parse_args()
+    if args.create_indexes:
+        create_match_indexes()
     query_matches()